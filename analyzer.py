@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
 import os
+import pickle
+import hashlib
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import matplotlib.pyplot as plt
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 import matplotlib
 
@@ -13,11 +19,45 @@ matplotlib.use('Agg')
 # 字體設定 (支援中日韓字元，確保簡繁中、日、韓文顯示正常)
 plt.rcParams['font.sans-serif'] = ['Noto Sans CJK TC', 'Noto Sans CJK JP', 'Noto Sans CJK KR', 'Microsoft JhengHei', 'Arial Unicode MS', 'sans-serif']
 plt.rcParams['axes.unicode_minus'] = False
+# 繪圖效能：簡化路徑、分段光柵化，標籤不含數學式故關閉 mathtext 解析
+plt.rcParams['path.simplify'] = True
+plt.rcParams['agg.path.chunksize'] = 10000
+plt.rcParams['text.parse_math'] = False
 
 # 基礎分箱設定
 BIN_SIZE = 10.0
 X_MIN, X_MAX = -100, 100
 BINS = np.arange(X_MIN, X_MAX + 1, BIN_SIZE)
+# 繪圖分箱：於最右側多加一格 "> 100%" 極端區
+PLOT_BINS = np.append(BINS, X_MAX + BIN_SIZE)
+EXTREME_COLOR = '#FF4500'
+# 繪圖進程內重用的 (Figure, Axes)，首次繪圖時建立
+_CHART_FIG = None
+
+# 分析僅使用的價格欄位
+PRICE_COLS = ('close', 'high', 'low')
+# CSV 轉存的 Parquet 快取子目錄 (與 dayK 同層)
+PARQUET_SUBDIR = "dayK_parquet"
+
+# 報酬統計週期 (名稱, 交易日數)
+PERIODS = [('Week', 5), ('Month', 20), ('Year', 250)]
+PERIOD_DAYS = np.array([d for _, d in PERIODS], dtype=np.int64)
+# 報酬計算只需最後 (最長週期 + 1) 根 K 棒；少於 MIN_BARS 根的標的不列入分析
+TAIL_LEN = int(PERIOD_DAYS.max()) + 1
+MIN_BARS = 20
+
+# 單檔分析結果快取子目錄 (與 dayK 同層)；鍵值含最後一根 K 棒與參數雜湊，兩者不變即沿用上次結果
+ROW_CACHE_SUBDIR = "row_cache"
+# 快取格式版本：調整後既有項目全部失效 (v2 淘汰先前由過期 Parquet 算出、卻以新 CSV 鍵值存入的結果)
+ROW_CACHE_VERSION = 2
+PARAMS_HASH = hashlib.sha1(repr((ROW_CACHE_VERSION, PRICE_COLS, PERIODS)).encode()).hexdigest()
+
+def bin_counts(values, n_bins):
+    """
+    固定寬度分箱：以整數索引 + np.bincount 單次掃描取代 np.histogram 的邊界搜尋
+    """
+    idx = np.clip(((values - X_MIN) // BIN_SIZE).astype(np.int64), 0, n_bins - 1)
+    return idx, np.bincount(idx, minlength=n_bins)
 
 def get_market_url(market_id, ticker):
     """
@@ -56,27 +96,41 @@ def get_market_url(market_id, ticker):
         clean_ticker = ticker.split('.')[0]
         return f"https://www.wantgoo.com/stock/{clean_ticker}/technical-chart"
 
-def build_company_list(arr_pct, codes, names, bins, market_id):
+def build_link_array(codes, names, market_id):
+    """
+    一次產出所有標的的 HTML 超連結 (NumPy 字串陣列)，各週期清單直接以索引取用
+    """
+    codes_arr = np.asarray(codes, dtype=str)
+    names_arr = np.asarray(names, dtype=str)
+    urls = np.asarray([get_market_url(market_id, c) for c in codes], dtype=str)
+    links = np.char.add('<a href="', urls)
+    links = np.char.add(links, '" style="text-decoration:none; color:#0366d6;">')
+    links = np.char.add(np.char.add(links, codes_arr), '(')
+    return np.char.add(np.char.add(links, names_arr), ')</a>')
+
+def build_company_list(arr_pct, codes, names, bins, market_id, links_all=None):
     """
     產出 HTML 格式的分箱清單，支援動態超連結與飆股高亮
     """
     lines = [f"{'報酬區間':<12} | {'家數(比例)':<14} | 公司清單", "-"*80]
     total = len(arr_pct)
     
-    def make_link(i):
-        url = get_market_url(market_id, codes[i])
-        return f'<a href="{url}" style="text-decoration:none; color:#0366d6;">{codes[i]}({names[i]})</a>'
-
-    for lo in range(int(X_MIN), int(X_MAX), int(BIN_SIZE)):
-        up = lo + 10
-        lab = f"{lo}%~{up}%"
-        mask = (arr_pct >= lo) & (arr_pct < up)
-        cnt = int(mask.sum())
+    if links_all is None:
+        links_all = build_link_array(codes, names, market_id)
+
+    # 一次算出所有分箱索引，再以排序 + 切分取得各箱成員，避免逐箱遮罩掃描
+    n_bins = len(bins) - 1
+    valid_pos = np.flatnonzero((arr_pct >= X_MIN) & (arr_pct < X_MAX))
+    idx, counts = bin_counts(arr_pct[valid_pos], n_bins)
+    order = np.argsort(idx, kind='stable')
+    picked_by_bin = np.split(valid_pos[order], np.cumsum(counts)[:-1])
+
+    for b, lo in enumerate(bins[:-1]):
+        cnt = int(counts[b])
         if cnt == 0: continue
+        lab = f"{int(lo)}%~{int(lo + BIN_SIZE)}%"
         
-        picked_indices = np.where(mask)[0]
-        links = [make_link(idx) for idx in picked_indices]
-        lines.append(f"{lab:<12} | {cnt:>4} ({(cnt/total*100):5.1f}%) | {', '.join(links)}")
+        lines.append(f"{lab:<12} | {cnt:>4} ({(cnt/total*100):5.1f}%) | {', '.join(links_all[picked_by_bin[b]])}")
 
     # 處理 > 100% 的極端飆股
     extreme_mask = (arr_pct >= 100)
@@ -93,15 +147,278 @@ def build_company_list(arr_pct, codes, names, bins, market_id):
 
     return "\n".join(lines)
 
-def run_global_analysis(market_id="tw-share"):
+def tail_window(prices):
+    """取最後 TAIL_LEN 根 K 棒並靠右對齊，不足者前端補 NaN，回傳 (TAIL_LEN, 3) 矩陣"""
+    tail = np.full((TAIL_LEN, len(PRICE_COLS)), np.nan, dtype=np.float32)
+    k = min(len(prices), TAIL_LEN)
+    if k: tail[-k:] = prices[-k:]
+    return tail
+
+def period_returns(tails, lengths):
+    """
+    多檔向量化報酬：tails 為 (N, TAIL_LEN, 3) 靠右對齊的價格張量、lengths 為各檔 K 棒數，
+    每個週期以整欄切片一次算完 N 檔的 [最高, 收盤, 最低] 報酬率 (%)，回傳 (N, 週期數, 3)
+    資料不足或前收 <= 0 的週期填入 NaN
+    """
+    close, high, low = tails[..., 0], tails[..., 1], tails[..., 2]
+    out = np.full((len(tails), len(PERIODS), 3), np.nan)
+    for i, d in enumerate(PERIOD_DAYS):
+        prev = close[:, -d - 1]
+        ok = (lengths > d) & ~(prev <= 0)
+        h_win, l_win = high[ok, -d:], low[ok, -d:]
+        # fmax/fmin 略過區間內的 NaN；區間首日即為 NaN 時結果為 NaN
+        hmax = np.where(np.isnan(h_win[:, 0]), np.nan, np.fmax.reduce(h_win, axis=1))
+        lmin = np.where(np.isnan(l_win[:, 0]), np.nan, np.fmin.reduce(l_win, axis=1))
+        p = prev[ok]
+        out[ok, i, 0] = (hmax - p) / p
+        out[ok, i, 1] = (close[ok, -1] - p) / p
+        out[ok, i, 2] = (lmin - p) / p
+    return out * 100
+
+def cache_path(f):
+    """CSV 對應的 Parquet 快取路徑 (dayK_parquet/<檔名>.parquet)"""
+    return f.parent.parent / PARQUET_SUBDIR / f"{f.stem}.parquet"
+
+def is_cache_fresh(f):
+    """Parquet 快取存在且不舊於 CSV"""
+    try:
+        return cache_path(f).stat().st_mtime >= f.stat().st_mtime
+    except OSError:
+        return False
+
+def read_csv_prices(f):
+    """
+    解析 CSV 價格欄位：僅讀取需要的三欄並直接指定型別，省去其餘欄位與型別推斷
+    float32 足以表達股價，並減半後續區間歸約的記憶體頻寬
+    """
+    df = pd.read_csv(f, engine='c', usecols=lambda c: c.lower() in PRICE_COLS, dtype=np.float32)
+    df.columns = [c.lower() for c in df.columns]
+    return df[list(PRICE_COLS)]
+
+def write_cache(df, f):
+    """寫入 Parquet 快取 (先寫暫存檔再原子替換)；失敗不影響本次分析"""
+    pq_path = cache_path(f)
+    tmp_path = pq_path.with_suffix(".tmp")
+    try:
+        # 下載期間的先行分析早於 run_global_analysis 建立快取目錄，此處自行建立
+        pq_path.parent.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(tmp_path, index=False, compression="zstd")
+        os.replace(tmp_path, pq_path)
+    except Exception:
+        pass
+
+def refresh_cache(f):
+    """將單檔 CSV 轉存為 Parquet 快取 (可於子進程執行)，回傳是否成功"""
+    try:
+        write_cache(read_csv_prices(f), f)
+        return True
+    except Exception:
+        return False
+
+def load_prices(f):
+    """
+    讀取單檔價格欄位：Parquet 快取不舊於 CSV 時直接載入，否則解析 CSV 並回寫快取
+    """
+    if is_cache_fresh(f):
+        try:
+            return pd.read_parquet(cache_path(f), columns=list(PRICE_COLS))
+        except Exception:
+            pass  # 快取損毀，改走 CSV
+    df = read_csv_prices(f)
+    write_cache(df, f)
+    return df
+
+def last_bar(f):
+    """讀取 CSV 最後一列的原始位元組 (僅讀檔尾，不解析整檔)"""
+    with open(f, 'rb') as fh:
+        fh.seek(0, os.SEEK_END)
+        fh.seek(max(0, fh.tell() - 512))
+        return fh.read().rstrip().rsplit(b'\n', 1)[-1]
+
+def row_key(f):
+    """結果快取鍵值：sha1(檔名 + 最後一根 K 棒 + 分析參數)"""
+    return hashlib.sha1(b"|".join([f.stem.encode(), last_bar(f), PARAMS_HASH.encode()])).hexdigest()
+
+def row_cache_path(f):
+    """CSV 對應的結果快取路徑 (row_cache/<檔名>.pkl)"""
+    return f.parent.parent / ROW_CACHE_SUBDIR / f"{f.stem}.pkl"
+
+def load_row(f, key):
+    """讀取結果快取，鍵值相符回傳 (True, 報酬列)，否則 (False, None)；報酬列可能為 None (資料不足)"""
+    try:
+        with open(row_cache_path(f), 'rb') as fh:
+            cached_key, row = pickle.load(fh)
+        if cached_key == key:
+            return True, row
+    except Exception:
+        pass
+    return False, None
+
+def save_row(f, key, row):
+    """寫入結果快取 (先寫暫存檔再原子替換)；失敗不影響本次分析"""
+    pkl_path = row_cache_path(f)
+    tmp_path = pkl_path.with_suffix(".tmp")
+    try:
+        pkl_path.parent.mkdir(exist_ok=True)
+        with open(tmp_path, 'wb') as fh:
+            pickle.dump((key, row), fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, pkl_path)
+    except Exception:
+        pass
+
+def scan_prices(pq_paths):
+    """
+    以 pyarrow.dataset 對所有 Parquet 快取做單次多執行緒掃描，
+    依檔案順序逐檔產出 (檔名 stem, [close, high, low] 價格矩陣)
+    掃描途中遇到損毀的檔案時，尚未產出的檔案改為逐檔讀取，讀取失敗者略過 (由呼叫端改讀 CSV)
+    """
+    yielded = set()
+    try:
+        scanner = ds.dataset(pq_paths, format="parquet").scanner(columns=list(PRICE_COLS))
+        cur_path, chunks = None, []
+        for tagged in scanner.scan_batches():
+            path = tagged.fragment.path
+            if path != cur_path and chunks:
+                yield batches_to_prices(cur_path, chunks)
+                yielded.add(cur_path)
+                chunks = []
+            cur_path = path
+            chunks.append(tagged.record_batch)
+        if chunks:
+            yield batches_to_prices(cur_path, chunks)
+        return
+    except (pa.ArrowException, OSError):
+        pass
+    for path in pq_paths:
+        if path in yielded: continue
+        try:
+            tbl = pq.read_table(path, columns=list(PRICE_COLS))
+        except (pa.ArrowException, OSError):
+            continue
+        yield table_to_prices(path, tbl)
+
+def batches_to_prices(path, chunks):
+    """將同一檔案的 RecordBatch 合併為 (stem, float32 價格矩陣)"""
+    return table_to_prices(path, pa.Table.from_batches(chunks))
+
+def table_to_prices(path, tbl):
+    """將單檔價格表轉為 (stem, float32 價格矩陣)"""
+    prices = np.column_stack([tbl.column(c).to_numpy() for c in PRICE_COLS]).astype(np.float32, copy=False)
+    return Path(path).stem, prices
+
+def parse_name(stem, market_id="tw-share"):
+    """由檔名解析 (代號, 名稱)"""
+    # 多國檔名解析策略
+    if market_id in ["hk-share", "jp-share", "kr-share"]:
+        # 港日韓多為單一代號格式 (如 7203.T.csv 或 005930.KS.csv)
+        return stem, stem
+    elif "_" in stem:
+        # 台、美、中 (如 AAPL_Apple.csv 或 600519_貴州茅台.csv)
+        return tuple(stem.split('_', 1))
+    return stem, stem
+
+def make_row(stem, rets, market_id="tw-share"):
+    """將單檔 (週期數, 3) 報酬矩陣組成報表列，資料不足的週期不列出"""
+    tkr, nm = parse_name(stem, market_id)
+    row = {'Ticker': tkr, 'Full_Name': nm}
+    for (p_name, _), (r_high, r_close, r_low) in zip(PERIODS, rets):
+        if np.isnan(r_close): continue
+        row[f'{p_name}_High'] = r_high
+        row[f'{p_name}_Close'] = r_close
+        row[f'{p_name}_Low'] = r_low
+    return row
+
+def compute_rows(entries, market_id="tw-share"):
+    """
+    多檔報酬計算：entries 為 (CSV 路徑, 快取鍵值, 價格矩陣) 序列，
+    各檔最後 TAIL_LEN 根 K 棒疊成 (N, TAIL_LEN, 3) 張量後以單次向量化運算算完，
+    結果寫入結果快取 (鍵值為 None 者不寫)，回傳 {檔名 stem: 報酬列或 None}
+    價格必須來自目前的 CSV 或不舊於 CSV 的 Parquet 快取，否則鍵值須傳 None，以免舊價格綁定到新鍵值
+    """
+    out, files, keys, tails, lengths = {}, [], [], [], []
+    for f, key, prices in entries:
+        if len(prices) < MIN_BARS:
+            out[f.stem] = None
+            if key is not None: save_row(f, key, None)
+            continue
+        files.append(f)
+        keys.append(key)
+        tails.append(tail_window(prices))
+        lengths.append(len(prices))
+    if files:
+        rets = period_returns(np.stack(tails), np.array(lengths))
+        for f, key, r in zip(files, keys, rets):
+            out[f.stem] = row = make_row(f.stem, r, market_id)
+            if key is not None: save_row(f, key, row)
+    return out
+
+def analyze_chunk(files, market_id="tw-share"):
+    """
+    多檔分析 (可於子進程執行)：結果快取命中者直接沿用，其餘讀取 CSV (或其快取) 後一併計算，
+    回傳 {檔名 stem: 報酬列或 None}；讀取失敗的檔案不列入，留待 run_global_analysis 處理
+    """
+    out, entries = {}, []
+    for f in files:
+        try:
+            key = row_key(f)
+            hit, row = load_row(f, key)
+            if hit:
+                out[f.stem] = row
+                continue
+            entries.append((f, key, load_prices(f).to_numpy(dtype=np.float32)))
+        except Exception:
+            continue
+    out.update(compute_rows(entries, market_id))
+    return out
+
+def render_chart(job):
+    """
+    繪製單張報酬分布圖 (可於子進程執行)，同一進程內共用一組 Figure/Axes
+    """
+    global _CHART_FIG
+    counts, n_samples, color, title, img_path = job
+    if _CHART_FIG is None:
+        _CHART_FIG = plt.subplots(figsize=(12, 7))
+    fig, ax = _CHART_FIG
+    ax.clear()
+    edges = PLOT_BINS
+    
+    ax.bar(edges[:-2], counts[:-1], width=9, align='edge', 
+           color=color, alpha=0.7, edgecolor='white')
+    ax.bar(edges[-2], counts[-1], width=9, align='edge', 
+           color=EXTREME_COLOR, alpha=0.9, edgecolor='black', linewidth=1.5)
+    
+    max_h = counts.max() if len(counts) > 0 else 1
+    for i, h in enumerate(counts):
+        if h > 0:
+            x_pos = edges[i] + 4.5
+            is_extreme = (i == len(counts) - 1)
+            ax.text(x_pos, h + (max_h * 0.02), f'{int(h)}\n({h/n_samples*100:.1f}%)', 
+                    ha='center', va='bottom', fontsize=9, fontweight='bold', 
+                    color='red' if is_extreme else 'black')
+
+    ax.set_ylim(0, max_h * 1.4) 
+    ax.set_title(title, fontsize=18, fontweight='bold')
+    ax.set_xticks(PLOT_BINS)
+    x_labels = [f"{int(x)}%" for x in BINS] + [f">{int(X_MAX)}%"]
+    ax.set_xticklabels(x_labels, rotation=45)
+    ax.grid(axis='y', linestyle='--', alpha=0.3)
+    fig.tight_layout()
+    fig.savefig(img_path, dpi=120)
+    return img_path
+
+def run_global_analysis(market_id="tw-share", rows=None, image_dir=None):
     """
     分析主邏輯：讀取 CSV -> 計算回報率 -> 繪製分布圖 -> 生成文字報表
+    rows: 下載期間已先行分析的結果 {檔名 stem: analyze_chunk 回傳的報酬列或 None}，這些檔案不再重新讀取
+    image_dir: 圖表輸出目錄 (預設 ./output/images/<market_id>)；回傳的圖表僅含檔案路徑，不含影像內容
     """
     market_label = market_id.upper()
     print(f"📊 正在啟動 {market_label} 深度矩陣分析...")
     
     data_path = Path("./data") / market_id / "dayK"
-    image_out_dir = Path("./output/images") / market_id
+    (data_path.parent / PARQUET_SUBDIR).mkdir(parents=True, exist_ok=True)
+    image_out_dir = Path(image_dir) if image_dir else Path("./output/images") / market_id
     image_out_dir.mkdir(parents=True, exist_ok=True)
     
     all_files = list(data_path.glob("*.csv"))
@@ -109,49 +426,53 @@ def run_global_analysis(market_id="tw-share"):
         print(f"⚠️ 找不到 {market_id} 的 CSV 數據檔案。")
         return [], pd.DataFrame(), {}
 
-    results = []
-    for f in tqdm(all_files, desc=f"分析 {market_label} 數據"):
+    done = dict(rows or {})
+    # 0. 最後一根 K 棒未變動者直接沿用結果快取，不再讀取價格
+    keys = {}
+    for f in all_files:
+        if f.stem in done: continue
         try:
-            df = pd.read_csv(f)
-            if len(df) < 20: continue
-            df.columns = [c.lower() for c in df.columns]
-            close, high, low = df['close'].values, df['high'].values, df['low'].values
-            
-            # 解析代號與名稱
-            stem = f.name.replace(".csv", "")
-            
-            # 多國檔名解析策略
-            if market_id in ["hk-share", "jp-share", "kr-share"]:
-                # 港日韓多為單一代號格式 (如 7203.T.csv 或 005930.KS.csv)
-                tkr = stem
-                nm = stem
-            elif "_" in stem:
-                # 台、美、中 (如 AAPL_Apple.csv 或 600519_貴州茅台.csv)
-                tkr, nm = stem.split('_', 1)
-            else:
-                tkr, nm = stem, stem
-                
-            row = {'Ticker': tkr, 'Full_Name': nm}
-            
-            periods = [('Week', 5), ('Month', 20), ('Year', 250)]
-            for p_name, days in periods:
-                if len(close) <= days: continue
-                prev_c = close[-(days+1)]
-                if prev_c <= 0: continue
-                row[f'{p_name}_High'] = (max(high[-days:]) - prev_c) / prev_c * 100
-                row[f'{p_name}_Close'] = (close[-1] - prev_c) / prev_c * 100
-                row[f'{p_name}_Low'] = (min(low[-days:]) - prev_c) / prev_c * 100
-            results.append(row)
-        except: continue
+            keys[f.stem] = key = row_key(f)
+        except OSError:
+            continue
+        hit, row = load_row(f, key)
+        if hit: done[f.stem] = row
+    pending = [f for f in all_files if f.stem not in done]
+    pending_by_stem = {f.stem: f for f in pending}
+
+    # 1. 僅對缺少或過期快取的 CSV 重新解析並轉存 Parquet (多進程，chunksize 攤提 IPC 成本)
+    stale = [f for f in pending if not is_cache_fresh(f)]
+    if stale:
+        with ProcessPoolExecutor() as executor:
+            list(tqdm(executor.map(refresh_cache, stale, chunksize=32), total=len(stale), desc=f"轉換 {market_label} 快取"))
+
+    # 2. 以 pyarrow.dataset 單次掃描其餘快取，逐檔計算報酬
+    # 只掃描不舊於 CSV 的快取；轉存失敗 (如 CSV 缺少價格欄位) 者不得沿用舊快取的價格
+    cached = [f for f in pending if is_cache_fresh(f)]
+    pq_paths = [str(cache_path(f)) for f in cached]
+    results = [row for row in done.values() if row]
+    if pq_paths:
+        scanned = tqdm(scan_prices(pq_paths), total=len(pq_paths), desc=f"分析 {market_label} 數據")
+        entries = ((pending_by_stem[stem], keys.get(stem), prices) for stem, prices in scanned)
+        computed = compute_rows(entries, market_id)
+        # 快取無法讀取的檔案改讀 CSV (並重建其快取)
+        entries = []
+        for f in cached:
+            if f.stem in computed: continue
+            try:
+                entries.append((f, keys.get(f.stem), load_prices(f).to_numpy(dtype=np.float32)))
+            except Exception:
+                continue
+        computed.update(compute_rows(entries, market_id))
+        results.extend(row for row in computed.values() if row)
 
     df_res = pd.DataFrame(results)
     if df_res.empty: return [], df_res, {}
 
     # --- 繪圖邏輯 ---
-    images = []
+    # 分箱計數在主進程完成 (bincount 成本極低)，僅將渲染工作分派給子進程
+    images, jobs = [], []
     color_map = {'High': '#28a745', 'Close': '#007bff', 'Low': '#dc3545'}
-    EXTREME_COLOR = '#FF4500' 
-    plot_bins = np.append(BINS, X_MAX + BIN_SIZE)
 
     for p_n, p_z in [('Week', '週'), ('Month', '月'), ('Year', '年')]:
         for t_n, t_z in [('High', '最高-進攻'), ('Close', '收盤-實質'), ('Low', '最低-防禦')]:
@@ -159,41 +480,25 @@ def run_global_analysis(market_id="tw-share"):
             if col not in df_res.columns: continue
             data = df_res[col].dropna()
             
-            fig, ax = plt.subplots(figsize=(12, 7))
             clipped_data = np.clip(data.values, X_MIN, X_MAX + BIN_SIZE)
-            counts, edges = np.histogram(clipped_data, bins=plot_bins)
-            
-            ax.bar(edges[:-2], counts[:-1], width=9, align='edge', 
-                   color=color_map[t_n], alpha=0.7, edgecolor='white')
-            ax.bar(edges[-2], counts[-1], width=9, align='edge', 
-                   color=EXTREME_COLOR, alpha=0.9, edgecolor='black', linewidth=1.5)
-            
-            max_h = counts.max() if len(counts) > 0 else 1
-            for i, h in enumerate(counts):
-                if h > 0:
-                    x_pos = edges[i] + 4.5
-                    is_extreme = (i == len(counts) - 1)
-                    ax.text(x_pos, h + (max_h * 0.02), f'{int(h)}\n({h/len(data)*100:.1f}%)', 
-                            ha='center', va='bottom', fontsize=9, fontweight='bold', 
-                            color='red' if is_extreme else 'black')
-
-            ax.set_ylim(0, max_h * 1.4) 
-            ax.set_title(f"【{market_label}】{p_z}K {t_z} 報酬分布 (樣本:{len(data)})", fontsize=18, fontweight='bold')
-            ax.set_xticks(plot_bins)
-            x_labels = [f"{int(x)}%" for x in BINS] + [f">{int(X_MAX)}%"]
-            ax.set_xticklabels(x_labels, rotation=45)
-            ax.grid(axis='y', linestyle='--', alpha=0.3)
-            plt.tight_layout()
+            _, counts = bin_counts(clipped_data, len(PLOT_BINS) - 1)
+            title = f"【{market_label}】{p_z}K {t_z} 報酬分布 (樣本:{len(data)})"
             
             img_path = image_out_dir / f"{col.lower()}.png"
-            plt.savefig(img_path, dpi=120)
-            plt.close()
+            jobs.append((counts, len(data), color_map[t_n], title, str(img_path)))
             images.append({'id': col.lower(), 'path': str(img_path), 'label': f"【{market_label}】{p_z}K {t_z}"})
 
+    # Agg 後端非執行緒安全，但各進程獨立，可並行渲染
+    with ProcessPoolExecutor(max_workers=max(1, min(len(jobs), os.cpu_count() or 1))) as executor:
+        list(executor.map(render_chart, jobs))
+
     text_reports = {}
+    codes, names = df_res['Ticker'].tolist(), df_res['Full_Name'].tolist()
+    # 超連結與週期無關，三個週期共用同一份
+    links_all = build_link_array(codes, names, market_id)
     for p_n in ['Week', 'Month', 'Year']:
         col = f'{p_n}_High'
         if col in df_res.columns:
-            text_reports[p_n] = build_company_list(df_res[col].values, df_res['Ticker'].tolist(), df_res['Full_Name'].tolist(), BINS, market_id)
+            text_reports[p_n] = build_company_list(df_res[col].values, codes, names, BINS, market_id, links_all)
     
     return images, df_res, text_reports
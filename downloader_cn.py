@@ -1,21 +1,22 @@
 # -*- coding: utf-8 -*-
-import os, time, random, json, subprocess
+import os, subprocess
 import pandas as pd
 import yfinance as yf
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from tqdm import tqdm
 from pathlib import Path
+from rate_limiter import TokenBucket
+import yf_history
+from yf_history import is_fresh, load_list_cache, save_history, save_list_cache, today_start
 
 # ========== 核心參數與路徑 ==========
 MARKET_CODE = "cn-share"
 DATA_SUBDIR = "dayK"
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "data", MARKET_CODE, DATA_SUBDIR)
-CACHE_LIST_PATH = os.path.join(BASE_DIR, "cn_stock_list_cache.json")
+CACHE_LIST_PATH = os.path.join(BASE_DIR, "cn_stock_list_cache.parquet")
 
-# 中國 A 股標的極多，建議控制執行緒在 3-4 之間，避免被封 IP
-THREADS_CN = 4
+# 中國 A 股標的極多，以 yf.download 批次請求取代逐檔請求，每批 100 檔
+BATCH_SIZE = 100
+BUCKET = TokenBucket(rate=3)
 os.makedirs(DATA_DIR, exist_ok=True)
 
 def log(msg: str):
@@ -23,12 +24,10 @@ def log(msg: str):
 
 def get_cn_list():
     """使用 akshare 獲取 A 股清單，具備今日快取機制與雙接口備援"""
-    if os.path.exists(CACHE_LIST_PATH):
-        file_mtime = os.path.getmtime(CACHE_LIST_PATH)
-        if datetime.fromtimestamp(file_mtime).date() == datetime.now().date():
-            log("📦 載入今日 A 股清單快取...")
-            with open(CACHE_LIST_PATH, "r", encoding="utf-8") as f:
-                return json.load(f)
+    cached = load_list_cache(CACHE_LIST_PATH)
+    if cached is not None:
+        log("📦 載入今日 A 股清單快取...")
+        return cached
 
     log("📡 正在獲取最新 A 股清單 (東方財富接口)...")
     try:
@@ -44,8 +43,7 @@ def get_cn_list():
         res = [f"{row['代码']}&{row['名称']}" for _, row in df.iterrows()]
         
         if len(res) > 1000:
-            with open(CACHE_LIST_PATH, "w", encoding="utf-8") as f:
-                json.dump(res, f, ensure_ascii=False)
+            save_list_cache(res, CACHE_LIST_PATH)
             log(f"✅ 成功獲取 {len(res)} 檔 A 股標的")
             return res
         else:
@@ -61,39 +59,45 @@ def get_cn_list():
         except:
             return ["600519&貴州茅台", "000001&平安銀行"]
 
-def download_one(item):
-    """下載 A 股數據，判斷交易所後綴 (.SS 或 .SZ)"""
+def resolve_item(item):
+    """解析 "代號&名稱"，回傳 (symbol, out_path)，格式錯誤回傳 None；判斷交易所後綴 (.SS 或 .SZ)"""
+    parts = item.split('&', 1)
+    if len(parts) < 2: return None
+    code, name = parts
+    # Yahoo Finance 格式：6開頭 (含688) 為上海 .SS, 其餘為深圳 .SZ
+    if code.startswith('6'):
+        symbol = f"{code}.SS"
+    else:
+        symbol = f"{code}.SZ"
+    return symbol, os.path.join(DATA_DIR, f"{code}_{name}.csv")
+
+def download_one(item, cutoff=None):
+    """下載單檔 A 股數據 (亦為批次失敗時的備援)"""
     try:
-        code, name = item.split('&', 1)
-        # Yahoo Finance 格式：6開頭 (含688) 為上海 .SS, 其餘為深圳 .SZ
-        if code.startswith('6'):
-            symbol = f"{code}.SS"
-        else:
-            symbol = f"{code}.SZ"
-            
-        out_path = os.path.join(DATA_DIR, f"{code}_{name}.csv")
+        resolved = resolve_item(item)
+        if resolved is None: return {"status": "error", "tkr": item}
+        symbol, out_path = resolved
 
-        # ✅ 今日快取檢查
-        if os.path.exists(out_path):
-            mtime = datetime.fromtimestamp(os.path.getmtime(out_path)).date()
-            if mtime == datetime.now().date() and os.path.getsize(out_path) > 1000:
-                return {"status": "exists", "code": code}
+        if cutoff is None: cutoff = today_start()
+        if is_fresh(out_path, cutoff):
+            return {"status": "exists", "tkr": symbol, "path": out_path}
 
-        time.sleep(random.uniform(0.5, 1.2))
+        BUCKET.acquire()
         tk = yf.Ticker(symbol)
         # A 股建議用 2y 數據，因市場波動與政策週期較長
-        hist = tk.history(period="2y", timeout=20)
+        hist = tk.history(period="2y", auto_adjust=True, timeout=20)
         
         if hist is not None and not hist.empty:
-            hist.reset_index(inplace=True)
-            hist.columns = [c.lower() for c in hist.columns]
-            # 統一存檔格式
-            hist.to_csv(out_path, index=False, encoding='utf-8-sig')
-            return {"status": "success", "code": code}
+            save_history(hist, out_path)
+            return {"status": "success", "tkr": symbol, "path": out_path}
             
-        return {"status": "empty", "code": code}
+        return {"status": "empty", "tkr": symbol}
     except:
-        return {"status": "error", "code": item.split('&')[0]}
+        return {"status": "error", "tkr": item}
+
+def download_batch(batch):
+    """批次下載 (共用流程見 yf_history.download_batch)，失敗者交由 download_one 逐檔重試"""
+    return yf_history.download_batch(batch, resolve_item, download_one, timeout=20)
 
 def main():
     items = get_cn_list()
@@ -103,18 +107,8 @@ def main():
     log(f"🚀 開始下載中國 A 股 (共 {len(items)} 檔)")
     stats = {"success": 0, "exists": 0, "empty": 0, "error": 0}
     
-    with ThreadPoolExecutor(max_workers=THREADS_CN) as executor:
-        futs = {executor.submit(download_one, it): it for it in items}
-        pbar = tqdm(total=len(items), desc="CN 下載進度")
-        for f in as_completed(futs):
-            res = f.result()
-            stats[res.get("status", "error")] += 1
-            pbar.update(1)
-            
-            # 每處理 100 檔稍微休息，防止 IP 封鎖
-            if pbar.n % 100 == 0:
-                time.sleep(random.uniform(5, 10))
-        pbar.close()
+    for res in yf_history.iter_batches(items, BATCH_SIZE, download_batch, pause=(5, 10), desc="CN 下載進度"):
+        stats[res["status"]] += 1
     
     # ✨ 重要：封裝結果並 return 給 main.py
     report_stats = {
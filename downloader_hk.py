@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
-import os, io, time, random, sqlite3, requests
+import os, io, time, random, sqlite3
 import pandas as pd
 import yfinance as yf
 from io import StringIO
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 import urllib3
+from rate_limiter import TokenBucket
+from http_session import make_session
 
 # 忽略 SSL 警告 (港交所官網有時會報憑證錯誤)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -19,6 +21,9 @@ IS_GITHUB_ACTIONS = os.getenv('GITHUB_ACTIONS') == 'true'
 
 # ✅ 效能調優
 MAX_WORKERS = 3 if IS_GITHUB_ACTIONS else 5 
+BUCKET = TokenBucket(rate=1 if IS_GITHUB_ACTIONS else 8)
+
+SESSION = make_session()
 
 def log(msg: str):
     print(f"{pd.Timestamp.now():%H:%M:%S}: {msg}")
@@ -64,19 +69,16 @@ def get_hk_stock_list():
     log(f"📡 正在從港交所獲取名單...")
     try:
         # 使用 verify=False 避免 SSL 阻擋
-        r = requests.get(url, headers=headers, timeout=20, verify=False)
+        r = SESSION.get(url, headers=headers, timeout=20, verify=False)
         r.raise_for_status()
         
-        # 讀取 Excel
-        df_raw = pd.read_excel(io.BytesIO(r.content), header=None)
+        # 讀取 Excel (Rust 實作的 calamine 引擎，較 xlrd 快且省記憶體；僅讀第一張工作表)
+        df_raw = pd.read_excel(io.BytesIO(r.content), header=None, sheet_name=0, engine='calamine')
         
-        # 尋找包含 "Stock Code" 的正確起始行
-        hdr_idx = None
-        for i in range(len(df_raw)):
-            row_str = " ".join([str(x) for x in df_raw.iloc[i].values])
-            if "Stock Code" in row_str:
-                hdr_idx = i
-                break
+        # 尋找包含 "Stock Code" 的正確起始行 (表頭位於檔案前段，一次向量化掃描前 20 行)
+        probe = df_raw.head(20).astype(str).fillna("").agg(" ".join, axis=1)
+        hits = probe.str.contains("Stock Code", regex=False)
+        hdr_idx = int(hits.idxmax()) if hits.any() else None
         
         if hdr_idx is None: 
             log("❌ 找不到 Excel 表頭，請檢查網址是否有變。")
@@ -87,27 +89,27 @@ def get_hk_stock_list():
         df.columns = df_raw.iloc[hdr_idx].values
         
         conn = sqlite3.connect(DB_PATH)
-        stock_list = []
         
         # 💡 先清空舊 info 數據確保重新同步
         conn.execute("DELETE FROM stock_info")
 
-        for _, row in df.iterrows():
-            raw_code = str(row['Stock Code']).strip()
-            # 港股名稱可能在不同欄位名下 (English Stock Short Name)
-            name_col = [c for c in df.columns if 'Short Name' in str(c) and 'English' in str(c)]
-            name = str(row[name_col[0]]).strip() if name_col else "Unknown"
-            
-            # 港股普通股邏輯：數字且長度 <= 4 (或是 5 位但前幾位是 0)
-            if raw_code.isdigit() and int(raw_code) < 10000:
-                symbol = f"{raw_code.zfill(4)}.HK"
-                market = "HKEX"
-                
-                conn.execute("""
-                    INSERT OR REPLACE INTO stock_info (symbol, name, sector, market, updated_at) 
-                    VALUES (?, ?, ?, ?, ?)
-                """, (symbol, name, "Unknown", market, datetime.now().strftime("%Y-%m-%d")))
-                stock_list.append((symbol, name))
+        # 向量化解析：一次處理整欄代號與名稱，取代逐列 iterrows
+        codes = df['Stock Code'].astype(str).str.strip()
+        # 港股名稱可能在不同欄位名下 (English Stock Short Name)
+        name_col = next((c for c in df.columns if 'Short Name' in str(c) and 'English' in str(c)), None)
+        names = df[name_col].astype(str).str.strip() if name_col else pd.Series("Unknown", index=df.index)
+
+        # 港股普通股邏輯：數字且長度 <= 4 (或是 5 位但前幾位是 0)
+        is_num = codes.str.isdigit()
+        mask = is_num & (pd.to_numeric(codes.where(is_num), errors='coerce') < 10000)
+        symbols = codes[mask].str.zfill(4) + ".HK"
+        stock_list = list(zip(symbols, names[mask]))
+
+        today = datetime.now().strftime("%Y-%m-%d")
+        conn.executemany("""
+            INSERT OR REPLACE INTO stock_info (symbol, name, sector, market, updated_at) 
+            VALUES (?, ?, ?, ?, ?)
+        """, [(sym, nm, "Unknown", "HKEX", today) for sym, nm in stock_list])
                 
         conn.commit()
         conn.close()
@@ -128,8 +130,7 @@ def download_one(args):
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            wait_time = random.uniform(2.0, 4.0) if IS_GITHUB_ACTIONS else random.uniform(0.2, 0.5)
-            time.sleep(wait_time)
+            BUCKET.acquire()
             
             tk = yf.Ticker(symbol)
             hist = tk.history(start=start_date, timeout=25, auto_adjust=True)
@@ -171,10 +172,10 @@ def run_sync(mode='hot'):
     stats = {"success": 0, "empty": 0, "error": 0}
     fail_list = []
     
+    # executor.map 會一次提交全部工作，再依輸入順序產出結果 (結果已帶標的資訊，不需 future -> 標的 的對照字典)
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(download_one, (it[0], it[1], mode)): it[0] for it in items}
-        for f in tqdm(as_completed(futures), total=len(items), desc="HK同步"):
-            res = f.result()
+        args = ((symbol, name, mode) for symbol, name in items)
+        for res in tqdm(executor.map(download_one, args), total=len(items), desc="HK同步"):
             s = res.get("status", "error")
             stats[s if s in stats else 'error'] += 1
             if s == "error": fail_list.append(res.get("symbol"))
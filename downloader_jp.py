@@ -3,8 +3,9 @@ import os, sys, time, random, subprocess, sqlite3
 import pandas as pd
 import yfinance as yf
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
+from rate_limiter import TokenBucket
 
 # ====== 自動安裝必要套件 ======
 def ensure_pkg(pkg_install_name, import_name):
@@ -25,6 +26,7 @@ IS_GITHUB_ACTIONS = os.getenv('GITHUB_ACTIONS') == 'true'
 
 # ✅ 效能設定
 MAX_WORKERS = 3 if IS_GITHUB_ACTIONS else 5
+BUCKET = TokenBucket(rate=1.5 if IS_GITHUB_ACTIONS else 8)
 
 def log(msg: str):
     print(f"{pd.Timestamp.now():%H:%M:%S}: {msg}")
@@ -70,22 +72,21 @@ def get_jp_stock_list():
         name_col = next((c for c in ['銘柄名', 'Name', 'name', 'Issues'] if c in df.columns), None)
         sector_col = next((c for c in ['33業種区分', 'Sector', 'industry'] if c in df.columns), None)
 
+        # 向量化解析：代號前四碼為數字者視為普通股，取代逐列 iterrows
+        codes = df[code_col].astype(str).str.strip()
+        mask = (codes.str.len() >= 4) & codes.str[:4].str.isdigit()
+        symbols = codes[mask].str[:4] + ".T"
+        names = df.loc[mask, name_col].astype(str).str.strip() if name_col else pd.Series("Unknown", index=symbols.index)
+        sectors = df.loc[mask, sector_col].astype(str).str.strip() if sector_col else pd.Series("Unknown", index=symbols.index)
+        stock_list = list(zip(symbols, names))
+
+        # 寫入資訊表
         conn = sqlite3.connect(DB_PATH)
-        stock_list = []
-        
-        for _, row in df.iterrows():
-            raw_code = str(row[code_col]).strip()
-            if len(raw_code) >= 4 and raw_code[:4].isdigit():
-                symbol = f"{raw_code[:4]}.T"
-                name = str(row[name_col]).strip() if name_col else "Unknown"
-                sector = str(row[sector_col]).strip() if sector_col else "Unknown"
-                
-                # 寫入資訊表
-                conn.execute("""
-                    INSERT OR REPLACE INTO stock_info (symbol, name, sector, market, updated_at) 
-                    VALUES (?, ?, ?, ?, ?)
-                """, (symbol, name, sector, "TSE", datetime.now().strftime("%Y-%m-%d")))
-                stock_list.append((symbol, name))
+        today = datetime.now().strftime("%Y-%m-%d")
+        conn.executemany("""
+            INSERT OR REPLACE INTO stock_info (symbol, name, sector, market, updated_at) 
+            VALUES (?, ?, ?, ?, ?)
+        """, [(sym, nm, sec, "TSE", today) for sym, nm, sec in zip(symbols, names, sectors)])
         
         conn.commit()
         conn.close()
@@ -104,7 +105,7 @@ def download_one(args):
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            time.sleep(random.uniform(1.5, 3.0) if IS_GITHUB_ACTIONS else 0.2)
+            BUCKET.acquire()
             
             tk = yf.Ticker(symbol)
             hist = tk.history(start=start_date, timeout=25, auto_adjust=True)
@@ -149,10 +150,10 @@ def run_sync(mode='hot'):
     stats = {"success": 0, "empty": 0, "error": 0}
     fail_list = []
     
+    # executor.map 會一次提交全部工作，再依輸入順序產出結果 (結果已帶標的資訊，不需 future -> 標的 的對照字典)
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(download_one, (it[0], it[1], mode)): it[0] for it in items}
-        for f in tqdm(as_completed(futures), total=len(items), desc="JP同步"):
-            res = f.result()
+        args = ((symbol, name, mode) for symbol, name in items)
+        for res in tqdm(executor.map(download_one, args), total=len(items), desc="JP同步"):
             s = res.get("status", "error")
             stats[s if s in stats else 'error'] += 1
             if s == "error": fail_list.append(res.get("symbol"))
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
-import os, sys, time, random, logging, warnings, subprocess, json
+import os, sys, time, logging, functools, warnings, subprocess, json, sqlite3
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
+import numpy as np
 import pandas as pd
 import yfinance as yf
+from rate_limiter import TokenBucket
+from yf_history import is_fresh, today_start, write_csv
 
 # ====== 自動安裝必要套件 ======
 def ensure_pkg(pkg: str):
@@ -29,9 +32,12 @@ LIST_DIR = os.path.join(BASE_DIR, "data", MARKET_CODE, "lists")
 os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(LIST_DIR, exist_ok=True)
 
-# 續跑清單紀錄檔案
-MANIFEST_CSV = Path(LIST_DIR) / "kr_manifest.csv"
+# 續跑清單紀錄檔案 (SQLite，逐檔更新狀態，不需整份重寫)
+MANIFEST_DB = Path(LIST_DIR) / "kr_manifest.db"
+# 每完成多少檔提交一次續跑清單
+CHECKPOINT_EVERY = 100
 THREADS = 4
+BUCKET = TokenBucket(rate=6)
 
 def log(msg: str):
     print(f"{pd.Timestamp.now():%H:%M:%S}: {msg}")
@@ -76,7 +82,30 @@ def get_kr_list():
         # 基礎備援
         return pd.DataFrame([{"code":"005930","name":"三星電子","board":"KS", "status": "pending"}])
 
-def download_one(row_data):
+def open_manifest(mf, cutoff):
+    """
+    開啟續跑清單資料庫 (WAL 模式)：先沿用今日先前執行已確認無資料 (empty) 的標的狀態，
+    中斷後重跑不再重複請求；再以本次名單整批重建 (同時清除已下市標的)
+    """
+    conn = sqlite3.connect(MANIFEST_DB)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute('''CREATE TABLE IF NOT EXISTS manifest (
+                        code TEXT PRIMARY KEY, 
+                        name TEXT, 
+                        board TEXT, 
+                        status TEXT, 
+                        mtime REAL)''')
+    prev = dict(conn.execute("SELECT code, status FROM manifest WHERE status = 'empty' AND mtime >= ?", (cutoff,)).fetchall())
+    pending = mf["status"] == "pending"
+    mf.loc[pending, "status"] = mf.loc[pending, "code"].map(prev).fillna("pending")
+    conn.execute("DELETE FROM manifest")
+    now = time.time()
+    conn.executemany("INSERT INTO manifest (code, name, board, status, mtime) VALUES (?, ?, ?, ?, ?)",
+                     [(c, n, b, s, now) for c, n, b, s in mf[['code', 'name', 'board', 'status']].itertuples(index=False)])
+    conn.commit()
+    return conn
+
+def download_one(row_data, cutoff):
     """下載單一韓股 K 線數據"""
     idx, row = row_data
     code, board = row['code'], row['board']
@@ -85,26 +114,22 @@ def download_one(row_data):
     out_path = os.path.join(DATA_DIR, f"{code}.{board}.csv")
     
     # ✅ 今日快取檢查
-    if os.path.exists(out_path):
-        mtime = datetime.fromtimestamp(os.path.getmtime(out_path)).date()
-        if mtime == datetime.now().date() and os.path.getsize(out_path) > 1000:
-            return idx, "exists"
+    if is_fresh(out_path, cutoff):
+        return idx, "exists"
 
     try:
-        time.sleep(random.uniform(0.3, 1.0)) # 隨機延遲防止封鎖
+        BUCKET.acquire() # 全域限速防止封鎖
         tk = yf.Ticker(symbol)
         df_raw = tk.history(period="2y", interval="1d", auto_adjust=False)
         df = standardize_df(df_raw)
         
         if not df.empty:
-            df.to_csv(out_path, index=False, encoding='utf-8-sig')
+            write_csv(df, out_path)
             return idx, "done"
         return idx, "empty"
     except:
         return idx, "failed"
 
-from datetime import datetime
-
 def main():
     log("🇰🇷 啟動韓股下載引擎 (KOSPI/KOSDAQ)")
     
@@ -114,34 +139,41 @@ def main():
         return {"total": 0, "success": 0, "fail": 0}
 
     # 2. 偵測本機已存在的檔案 (續跑機制)
-    existing_files = [f for f in os.listdir(DATA_DIR) if f.endswith(".csv")]
-    for f in existing_files:
-        code_part = f.replace(".csv", "")
-        if "." in code_part:
-            c, b = code_part.split(".")
-            mf.loc[(mf['code'] == c) & (mf['board'] == b), "status"] = "exists"
+    # 單次 scandir 取得所有檔案的 stat (DirEntry 會快取結果)，再依檔名對齊清單向量化判斷
+    st = pd.DataFrame([(e.name, e.stat().st_mtime, e.stat().st_size) for e in os.scandir(DATA_DIR) if e.name.endswith(".csv")],
+                      columns=["name", "mtime", "size"]).set_index("name")
+    aligned = st.reindex(mf['code'] + "." + mf['board'] + ".csv")
+    # 今日已更新且大小合理者視為已存在，其餘 (含過期檔案) 重新下載 (今日門檻整次執行只計算一次)
+    cutoff = today_start()
+    fresh = (aligned['mtime'].to_numpy() >= cutoff) & (aligned['size'].to_numpy() > 1000)
+    mf["status"] = np.where(fresh, "exists", "pending")
+    conn = open_manifest(mf, cutoff)
 
     todo = mf[mf["status"] == "pending"]
-    log(f"📝 總標的：{len(mf)} | 待處理：{len(todo)} | 已存在：{len(mf[mf['status']=='exists'])}")
+    log(f"📝 總標的：{len(mf)} | 待處理：{len(todo)} | 已存在：{len(mf[mf['status']=='exists'])} | 今日已確認無資料：{len(mf[mf['status']=='empty'])}")
 
     # 3. 多執行緒下載
     stats = {"done": 0, "exists": len(mf[mf['status']=='exists']), "empty": 0, "failed": 0}
     
     if not todo.empty:
         with ThreadPoolExecutor(max_workers=THREADS) as executor:
-            futures = {executor.submit(download_one, item): item for item in todo.iterrows()}
             pbar = tqdm(total=len(todo), desc="韓股下載進度")
             
-            for f in as_completed(futures):
-                idx, status = f.result()
+            for idx, status in executor.map(functools.partial(download_one, cutoff=cutoff), todo.iterrows()):
                 mf.at[idx, "status"] = status
+                conn.execute("UPDATE manifest SET status = ?, mtime = ? WHERE code = ?",
+                             (status, time.time(), mf.at[idx, "code"]))
                 if status in ["done", "empty", "failed"]:
                     stats[status if status != "done" else "done"] += 1
                 pbar.update(1)
+                # 定期提交續跑清單，中斷後可從斷點續跑
+                if pbar.n % CHECKPOINT_EVERY == 0:
+                    conn.commit()
             pbar.close()
 
     # 4. 儲存續跑清單
-    mf.to_csv(MANIFEST_CSV, index=False)
+    conn.commit()
+    conn.close()
     
     # ✨ 重要：構建回傳給 main.py 的統計字典
     report_stats = {
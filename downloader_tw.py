@@ -2,13 +2,16 @@
 import os
 import time
 import random
-import requests
+import asyncio
+import httpx
+import numpy as np
 import pandas as pd
 import yfinance as yf
 from io import StringIO
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from tqdm import tqdm
 from pathlib import Path
+from rate_limiter import TokenBucket
+import yf_history
+from yf_history import is_fresh, save_history, today_start
 
 # ========== 核心參數設定 ==========
 MARKET_CODE = "tw-share"
@@ -16,40 +19,61 @@ DATA_SUBDIR = "dayK"
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "data", MARKET_CODE, DATA_SUBDIR)
 
-# ✅ 效能優化：調低至 3，配合隨機延遲可有效避開 Yahoo 封鎖
-MAX_WORKERS = 3 
+# ✅ 效能優化：以 yf.download 批次請求取代逐檔請求，每批 100 檔
+BATCH_SIZE = 100
+BUCKET = TokenBucket(rate=3)
 Path(DATA_DIR).mkdir(parents=True, exist_ok=True)
 
+# 清單請求的最大同時連線數 (單一事件迴圈內共用 keep-alive 連線池)
+MAX_CONCURRENCY = 32
+# 暫時性錯誤的重試次數與狀態碼
+RETRY_TOTAL = 3
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
 def log(msg: str):
     print(f"{pd.Timestamp.now():%H:%M:%S}: {msg}")
 
-def get_full_stock_list():
-    """獲取台股全市場清單 (雙重機制：證交所 JSP + Akshare 備援)"""
-    url_configs = [
-        {'name': 'listed', 'url': 'https://isin.twse.com.tw/isin/class_main.jsp?market=1&issuetype=1&Page=1&chklike=Y', 'suffix': '.TW'},
-        {'name': 'dr', 'url': 'https://isin.twse.com.tw/isin/class_main.jsp?owncode=&stockname=&isincode=&market=1&issuetype=J&industry_code=&Page=1&chklike=Y', 'suffix': '.TW'},
-        {'name': 'otc', 'url': 'https://isin.twse.com.tw/isin/class_main.jsp?market=2&issuetype=4&Page=1&chklike=Y', 'suffix': '.TWO'},
-        {'name': 'etf', 'url': 'https://isin.twse.com.tw/isin/class_main.jsp?owncode=&stockname=&isincode=&market=1&issuetype=I&industry_code=&Page=1&chklike=Y', 'suffix': '.TW'},
-        {'name': 'rotc', 'url': 'https://isin.twse.com.tw/isin/class_main.jsp?owncode=&stockname=&isincode=&market=E&issuetype=R&industry_code=&Page=1&chklike=Y', 'suffix': '.TWO'},
-    ]
-    
-    all_items = []
+URL_CONFIGS = [
+    {'name': 'listed', 'url': 'https://isin.twse.com.tw/isin/class_main.jsp?market=1&issuetype=1&Page=1&chklike=Y', 'suffix': '.TW'},
+    {'name': 'dr', 'url': 'https://isin.twse.com.tw/isin/class_main.jsp?owncode=&stockname=&isincode=&market=1&issuetype=J&industry_code=&Page=1&chklike=Y', 'suffix': '.TW'},
+    {'name': 'otc', 'url': 'https://isin.twse.com.tw/isin/class_main.jsp?market=2&issuetype=4&Page=1&chklike=Y', 'suffix': '.TWO'},
+    {'name': 'etf', 'url': 'https://isin.twse.com.tw/isin/class_main.jsp?owncode=&stockname=&isincode=&market=1&issuetype=I&industry_code=&Page=1&chklike=Y', 'suffix': '.TW'},
+    {'name': 'rotc', 'url': 'https://isin.twse.com.tw/isin/class_main.jsp?owncode=&stockname=&isincode=&market=E&issuetype=R&industry_code=&Page=1&chklike=Y', 'suffix': '.TWO'},
+]
+
+async def fetch_list_page(client, sem, cfg):
+    """非同步抓取單一證交所清單頁並解析為 "代號&名稱" 項目；失敗回傳空 list"""
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}
+    try:
+        async with sem:
+            for attempt in range(RETRY_TOTAL + 1):
+                resp = await client.get(cfg['url'], headers=headers)
+                if resp.status_code not in RETRY_STATUS or attempt == RETRY_TOTAL: break
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        df_list = pd.read_html(StringIO(resp.text), header=0)
+        if not df_list: return []
+        df = df_list[0]
+        # 向量化字串處理：僅保留數字開頭的代號 (排除表頭、分類列與空值)
+        codes = df['有價證券代號'].astype(str).str.strip()
+        mask = codes.str.match(r'^\d')
+        names = df.loc[mask, '有價證券名稱'].astype(str).str.strip()
+        return (codes[mask] + cfg['suffix'] + "&" + names).tolist()
+    except Exception:
+        return []
+
+async def get_full_stock_list_async():
+    """獲取台股全市場清單 (雙重機制：證交所 JSP 並行請求 + Akshare 備援)"""
+    # 以 set 收集，插入時即去重
+    all_items = set()
     log("📡 [方案 A] 正在從證交所 JSP 獲取清單...")
     
-    for cfg in url_configs:
-        try:
-            headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'}
-            resp = requests.get(cfg['url'], timeout=15, headers=headers)
-            df_list = pd.read_html(StringIO(resp.text), header=0)
-            if not df_list: continue
-            df = df_list[0]
-            for _, row in df.iterrows():
-                code = str(row['有價證券代號']).strip()
-                name = str(row['有價證券名稱']).strip()
-                if code and '有價證券' not in code:
-                    all_items.append(f"{code}{cfg['suffix']}&{name}")
-        except Exception as e:
-            continue
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    limits = httpx.Limits(max_connections=MAX_CONCURRENCY, max_keepalive_connections=MAX_CONCURRENCY)
+    transport = httpx.AsyncHTTPTransport(retries=RETRY_TOTAL, limits=limits)
+    async with httpx.AsyncClient(transport=transport, timeout=15) as client:
+        pages = await asyncio.gather(*[asyncio.create_task(fetch_list_page(client, sem, cfg)) for cfg in URL_CONFIGS])
+    for page in pages:
+        all_items.update(page)
 
     # --- 方案 B: Akshare 備援 (當證交所失敗時) ---
     if len(all_items) < 500:
@@ -58,48 +82,49 @@ def get_full_stock_list():
             import akshare as ak
             # 獲取上市與上櫃清單
             df_tw_listed = ak.stock_tw_spot_em() # 台灣市場即時行情
-            for _, row in df_tw_listed.iterrows():
-                code = str(row['代码'])
-                name = str(row['名称'])
-                # Akshare 的代號通常需要判斷 .TW 或 .TWO
-                # 這裡簡單處理：如果是上市公司通常是 .TW，其餘 .TWO
-                suffix = ".TW" if len(code) == 4 and code.startswith(('2', '1', '3')) else ".TWO"
-                all_items.append(f"{code}{suffix}&{name}")
+            codes = df_tw_listed['代码'].astype(str)
+            names = df_tw_listed['名称'].astype(str)
+            # Akshare 的代號通常需要判斷 .TW 或 .TWO
+            # 這裡簡單處理：如果是上市公司通常是 .TW，其餘 .TWO
+            is_listed = (codes.str.len() == 4) & codes.str.startswith(('2', '1', '3'))
+            suffixes = pd.Series(np.where(is_listed, ".TW", ".TWO"), index=codes.index)
+            all_items.update((codes + suffixes + "&" + names).tolist())
         except Exception as e:
             log(f"❌ 備援方案亦失敗: {e}")
 
-    final_res = list(set(all_items))
+    final_res = list(all_items)
     log(f"✅ 台股清單獲取完成，共 {len(final_res)} 檔標的。")
     return final_res
 
-def download_stock_data(item):
-    """具備隨機延遲與自動重試的下載邏輯"""
+def get_full_stock_list():
+    """同步版清單獲取 (相容舊呼叫端)"""
+    return asyncio.run(get_full_stock_list_async())
+
+def resolve_item(item):
+    """解析 "代號&名稱" 清單項目，回傳 (yf_tkr, out_path)；格式錯誤回傳 None"""
+    return yf_history.resolve_item(item, DATA_DIR)
+
+def download_stock_data(item, cutoff=None):
+    """具備隨機延遲與自動重試的單檔下載邏輯 (批次失敗時的備援)"""
     yf_tkr = "ParseError"
     try:
-        parts = item.split('&', 1)
-        if len(parts) < 2: return {"status": "error", "tkr": item}
+        resolved = resolve_item(item)
+        if resolved is None: return {"status": "error", "tkr": item}
+        yf_tkr, out_path = resolved
         
-        yf_tkr, name = parts
-        safe_name = "".join([c for c in name if c.isalnum() or c in (' ', '_', '-')]).strip()
-        out_path = os.path.join(DATA_DIR, f"{yf_tkr}_{safe_name}.csv")
-        
-        # 今日快取檢查
-        if os.path.exists(out_path):
-            mtime = datetime.fromtimestamp(os.path.getmtime(out_path)).date()
-            if mtime == datetime.now().date() and os.path.getsize(out_path) > 1000:
-                return {"status": "exists", "tkr": yf_tkr}
+        if cutoff is None: cutoff = today_start()
+        if is_fresh(out_path, cutoff):
+            return {"status": "exists", "tkr": yf_tkr, "path": out_path}
 
-        time.sleep(random.uniform(0.5, 1.2))
+        BUCKET.acquire()
         tk = yf.Ticker(yf_tkr)
         
         for attempt in range(2):
             try:
-                hist = tk.history(period="2y", timeout=15)
+                hist = tk.history(period="2y", auto_adjust=True, timeout=15)
                 if hist is not None and not hist.empty:
-                    hist.reset_index(inplace=True)
-                    hist.columns = [c.lower() for c in hist.columns]
-                    hist.to_csv(out_path, index=False, encoding='utf-8-sig')
-                    return {"status": "success", "tkr": yf_tkr}
+                    save_history(hist, out_path)
+                    return {"status": "success", "tkr": yf_tkr, "path": out_path}
                 if attempt == 1: return {"status": "empty", "tkr": yf_tkr}
             except:
                 time.sleep(random.uniform(3, 7))
@@ -108,29 +133,28 @@ def download_stock_data(item):
     except:
         return {"status": "error", "tkr": yf_tkr}
 
-from datetime import datetime
+def download_batch(batch):
+    """批次下載 (共用流程見 yf_history.download_batch)，失敗者交由 download_stock_data 逐檔重試"""
+    return yf_history.download_batch(batch, resolve_item, download_stock_data, timeout=15)
 
-def main():
-    items = get_full_stock_list()
-    if not items:
-        return {"total": 0, "success": 0, "fail": 0}
-        
+def iter_results(items):
+    """
+    逐批下載並逐檔產出結果 {"status", "tkr", "path"}，
+    每批完成即交回呼叫端，讓後續處理 (如分析) 與下一批下載重疊進行
+    """
+    return yf_history.iter_batches(items, BATCH_SIZE, download_batch, pause=(5, 10), desc="台股下載")
+
+def download_all(items, on_result=None):
+    """
+    下載清單內全部標的並回傳統計字典；on_result 若提供，每檔完成時即以結果字典呼叫
+    """
     log(f"🚀 啟動台股下載任務，目標總數: {len(items)}")
     
     stats = {"success": 0, "exists": 0, "empty": 0, "error": 0}
-
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(download_stock_data, it): it for it in items}
-        pbar = tqdm(total=len(items), desc="台股下載")
-        
-        for future in as_completed(futures):
-            res = future.result()
-            stats[res["status"]] += 1
-            pbar.update(1)
-            
-            if pbar.n % 100 == 0:
-                time.sleep(random.uniform(5, 10))
-        pbar.close()
+    for res in iter_results(items):
+        stats[res["status"]] += 1
+        if on_result is not None:
+            on_result(res)
     
     # ✨ 重要：構建回傳給 main.py 的統計字典
     report_stats = {
@@ -145,5 +169,18 @@ def main():
     
     return report_stats # 👈 必須 Return 給 main.py
 
+async def main_async(on_result=None):
+    """
+    非同步入口：清單頁以 httpx 並行抓取，K 線批次下載 (yfinance 為同步 API) 交由執行緒執行
+    """
+    items = await get_full_stock_list_async()
+    if not items:
+        return {"total": 0, "success": 0, "fail": 0}
+    return await asyncio.to_thread(download_all, items, on_result)
+
+def main(on_result=None):
+    """同步入口 (相容舊呼叫端)"""
+    return asyncio.run(main_async(on_result))
+
 if __name__ == "__main__":
     main()
@@ -2,15 +2,14 @@
 import os
 import time
 import random
-import json
-import requests
 import pandas as pd
 import yfinance as yf
-from datetime import datetime
 from io import StringIO
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from tqdm import tqdm
 from pathlib import Path
+from rate_limiter import TokenBucket
+from http_session import make_session
+import yf_history
+from yf_history import is_fresh, load_list_cache, save_history, save_list_cache, today_start
 
 # ========== 核心參數設定 ==========
 MARKET_CODE = "us-share"
@@ -18,12 +17,15 @@ DATA_SUBDIR = "dayK"
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "data", MARKET_CODE, DATA_SUBDIR)
 # 清單快取路徑
-CACHE_LIST_PATH = os.path.join(BASE_DIR, "us_stock_list_cache.json")
+CACHE_LIST_PATH = os.path.join(BASE_DIR, "us_stock_list_cache.parquet")
 
-# 美股標的多，建議 4-5 執行緒，並配合隨機延遲
-MAX_WORKERS = 4 
+# 美股標的多，以 yf.download 批次請求取代逐檔請求，每批 100 檔
+BATCH_SIZE = 100
+BUCKET = TokenBucket(rate=3)
 Path(DATA_DIR).mkdir(parents=True, exist_ok=True)
 
+SESSION = make_session()
+
 def log(msg: str):
     print(f"{pd.Timestamp.now():%H:%M:%S}: {msg}")
 
@@ -39,13 +41,11 @@ def get_full_stock_list():
     """
     ⚡ 快取化清單獲取：優先從 Nasdaq 官網抓取清單，並過濾出普通股
     """
-    if os.path.exists(CACHE_LIST_PATH):
-        file_mtime = os.path.getmtime(CACHE_LIST_PATH)
-        # 如果檔案是今天產生的，就直接載入
-        if datetime.fromtimestamp(file_mtime).date() == datetime.now().date():
-            log("📦 偵測到今日已緩存美股清單，直接載入...")
-            with open(CACHE_LIST_PATH, "r", encoding="utf-8") as f:
-                return json.load(f)
+    # 如果快取是今天產生的，就直接載入
+    cached = load_list_cache(CACHE_LIST_PATH)
+    if cached is not None:
+        log("📦 偵測到今日已緩存美股清單，直接載入...")
+        return cached
 
     log("📡 緩存失效，開始從官網獲取美股普通股清單...")
     all_rows = []
@@ -53,7 +53,7 @@ def get_full_stock_list():
 
     # 1. NASDAQ 市場清單
     try:
-        r1 = requests.get("https://www.nasdaqtrader.com/dynamic/symdir/nasdaqlisted.txt", timeout=15, headers=headers)
+        r1 = SESSION.get("https://www.nasdaqtrader.com/dynamic/symdir/nasdaqlisted.txt", timeout=15, headers=headers)
         df1 = pd.read_csv(StringIO(r1.text), sep="|")
         df1 = df1[df1["Test Issue"] == "N"].dropna(subset=["Symbol", "Security Name"])
         for _, row in df1.iterrows():
@@ -65,7 +65,7 @@ def get_full_stock_list():
 
     # 2. NYSE 與其餘市場清單
     try:
-        r2 = requests.get("https://www.nasdaqtrader.com/dynamic/symdir/otherlisted.txt", timeout=15, headers=headers)
+        r2 = SESSION.get("https://www.nasdaqtrader.com/dynamic/symdir/otherlisted.txt", timeout=15, headers=headers)
         df2 = pd.read_csv(StringIO(r2.text), sep="|")
         df2 = df2[df2["Test Issue"] == "N"].dropna(subset=["NASDAQ Symbol", "Security Name"])
         for _, row in df2.iterrows():
@@ -78,44 +78,39 @@ def get_full_stock_list():
     final_list = list(set(all_rows))
     
     if final_list:
-        with open(CACHE_LIST_PATH, "w", encoding="utf-8") as f:
-            json.dump(final_list, f, ensure_ascii=False)
+        save_list_cache(final_list, CACHE_LIST_PATH)
         log(f"✅ 美股清單更新完成，共 {len(final_list)} 檔普通股。")
         return final_list
     else:
         log("❌ 無法獲取任何美股標的清單。")
         return []
 
-def download_stock_data(item):
+def resolve_item(item):
+    """解析 "代號&名稱" 清單項目，回傳 (yf_tkr, out_path)；格式錯誤回傳 None"""
+    return yf_history.resolve_item(item, DATA_DIR)
+
+def download_stock_data(item, cutoff=None):
     """
-    ⚡ 檔案級快取下載邏輯
+    ⚡ 檔案級快取下載邏輯 (單檔，亦為批次失敗時的備援)
     """
     try:
-        parts = item.split('&', 1)
-        if len(parts) < 2: return {"status": "error"}
-        yf_tkr, name = parts
-        
-        # 移除檔名非法字元
-        safe_name = "".join([c for c in name if c.isalnum() or c in (' ', '_', '-')]).strip()
-        out_path = os.path.join(DATA_DIR, f"{yf_tkr}_{safe_name}.csv")
+        resolved = resolve_item(item)
+        if resolved is None: return {"status": "error"}
+        yf_tkr, out_path = resolved
         
-        # ✅ 快取檢查：檢查檔案是否存在且是今天更新的
-        if os.path.exists(out_path):
-            mtime = datetime.fromtimestamp(os.path.getmtime(out_path)).date()
-            if mtime == datetime.now().date() and os.path.getsize(out_path) > 1000:
-                return {"status": "exists", "tkr": yf_tkr}
+        if cutoff is None: cutoff = today_start()
+        if is_fresh(out_path, cutoff):
+            return {"status": "exists", "tkr": yf_tkr}
 
         # --- 若無快取則下載 ---
-        time.sleep(random.uniform(0.4, 1.2))
+        BUCKET.acquire()
         tk = yf.Ticker(yf_tkr)
         
         for attempt in range(2):
             try:
-                hist = tk.history(period="2y", timeout=20)
+                hist = tk.history(period="2y", auto_adjust=True, timeout=20)
                 if hist is not None and not hist.empty:
-                    hist.reset_index(inplace=True)
-                    hist.columns = [c.lower() for c in hist.columns]
-                    hist.to_csv(out_path, index=False, encoding='utf-8-sig')
+                    save_history(hist, out_path)
                     return {"status": "success", "tkr": yf_tkr}
                 if attempt == 1: return {"status": "empty", "tkr": yf_tkr}
             except Exception as e:
@@ -127,6 +122,10 @@ def download_stock_data(item):
     except: 
         return {"status": "error"}
 
+def download_batch(batch):
+    """批次下載 (共用流程見 yf_history.download_batch)，失敗者交由 download_stock_data 逐檔重試"""
+    return yf_history.download_batch(batch, resolve_item, download_stock_data, timeout=20)
+
 def main():
     items = get_full_stock_list()
     if not items:
@@ -135,19 +134,9 @@ def main():
     log(f"🚀 啟動美股下載任務，目標總數: {len(items)}")
     stats = {"success": 0, "exists": 0, "empty": 0, "error": 0}
     
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(download_stock_data, it): it for it in items}
-        pbar = tqdm(total=len(items), desc="美股下載進度", unit="檔")
-        
-        for future in as_completed(futures):
-            res = future.result()
-            stats[res.get("status", "error")] += 1
-            pbar.update(1)
-            
-            # 每成功下載 100 檔額外休息，防止被 Yahoo 封鎖
-            if pbar.n % 100 == 0:
-                time.sleep(random.uniform(10, 20))
-        pbar.close()
+    # 美股批次間休息較久，防止被 Yahoo 封鎖
+    for res in yf_history.iter_batches(items, BATCH_SIZE, download_batch, pause=(10, 20), desc="美股下載進度"):
+        stats[res["status"]] += 1
     
     # ✨ 重要：構建回傳給 main.py 的統計字典
     report_stats = {
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+def make_session(pool_size=16, retries=3):
+    """共用 HTTP 連線池：keep-alive 重用 TCP/TLS 連線，並對暫時性錯誤自動重試"""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                          max_retries=Retry(total=retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])))
+    return session
@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
 import os
 import time
+import asyncio
 import argparse
-import traceback
-from datetime import datetime, timedelta
+import tempfile
+import logging
+import logging.handlers
+import queue
+import sys
+import faulthandler
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 
 # --- 導入模組 ---
 # 僅保留台灣下載器與核心分析模組
@@ -11,111 +19,165 @@ import downloader_tw
 import analyzer
 import notifier
 
-def run_market_pipeline(market_id, market_name, emoji):
+# 市場配置 (模組常數)：新增市場只需加一筆，argparse 選項亦由此產生
+MARKETS_CONFIG = {
+    "tw-share": {"name": "台灣股市", "emoji": "🇹🇼", "downloader": downloader_tw},
+}
+# 下載期間每累積此數量的 CSV 即打包送入分析進程 (攤提 IPC 成本並沿用向量化計算)
+ANALYZE_CHUNK = 32
+# 單一進程虛擬記憶體上限 (位元組)：超用時直接 MemoryError，避免在 swap 上拖慢整個任務
+MEMORY_LIMIT = 6 * 1024 ** 3
+
+# 統一的 Log 出口：實際寫出由 QueueListener 背景執行緒負責，主流程只做入列
+logger = logging.getLogger("monitor")
+
+def setup_logging():
+    """
+    以 QueueHandler/QueueListener 將 Log 寫出移出主執行緒，回傳已啟動的 listener
+    重複呼叫時先移除前次的 QueueHandler，避免同一則 Log 輸出多次
+    """
+    log_queue = queue.Queue(-1)
+    formatter = logging.Formatter("%(asctime)s %(message)s", datefmt="%H:%M:%S")
+    # 時間戳以台北時間顯示 (預設依主機時區，CI 上為 UTC)
+    formatter.converter = lambda ts: datetime.fromtimestamp(ts, notifier.TZ).timetuple()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(formatter)
+    listener = logging.handlers.QueueListener(log_queue, stream)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    listener.start()
+    return listener
+
+def set_memory_limit(limit=MEMORY_LIMIT):
+    """設定 RLIMIT_AS 軟上限 (僅限支援 resource 模組的平台，子進程會繼承)"""
+    try:
+        import resource
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY: limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+def run_market_pipeline(market_id, market_name, emoji, agent):
     """
     執行單一市場的完整管線：下載 -> 分析 -> 寄信
+    agent: 由 main() 建立並共用的通知器實例 (用於發送 Telegram 與 Resend 郵件)
     """
-    print("\n" + "="*60)
-    print(f"{emoji} 啟動管線：{market_name} ({market_id})")
-    print("="*60)
+    logger.info("="*60)
+    logger.info(f"{emoji} 啟動管線：{market_name} ({market_id})")
+    logger.info("="*60)
 
     # 初始化統計變數，預設為 0
     stats = {"total": 0, "success": 0, "fail": 0}
     
-    # 建立通知器實例 (用於發送 Telegram 與 Resend 郵件)
-    agent = notifier.StockNotifier()
+    # --- Step 1: 數據獲取 (同時將已落地的 CSV 送入分析進程) ---
+    logger.info(f"【Step 1: 數據獲取】正在更新 {market_name} 原始 K 線資料...")
+    rows = {}
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        futures, ready = [], []
 
-    # --- Step 1: 數據獲取 ---
-    print(f"【Step 1: 數據獲取】正在更新 {market_name} 原始 K 線資料...")
-    try:
-        res = None
-        # 僅執行台灣股市下載
-        if market_id == "tw-share":
-            res = downloader_tw.main()
-        else:
-            print(f"⚠️ 未知的市場 ID: {market_id}")
-            return
-
-        # ✨ 數據標準化
-        if isinstance(res, dict):
-            stats = res
-            print(f"📊 [下載報告] 總計: {stats.get('total', 0)} | 成功: {stats.get('success', 0)} | 失敗: {stats.get('fail', 0)}")
-        elif res is not None and hasattr(res, '__len__'):
-            # 相容舊版回傳 List 的格式
-            stats = {"total": len(res), "success": len(res), "fail": 0}
-            print(f"📊 [下載報告] 已獲取 {len(res)} 檔標的。")
-        else:
-            print(f"⚠️ {market_name} 下載器未回傳有效數據，報告可能顯示為 0。")
-
-    except Exception as e:
-        print(f"❌ {market_name} 數據下載過程發生嚴重異常: {e}")
+        def flush_ready():
+            if ready:
+                futures.append(executor.submit(analyzer.analyze_chunk, list(ready), market_id))
+                ready.clear()
+
+        def submit_ready(res):
+            # 下載成功或今日已有快取的標的分批送入分析，與後續批次的網路等待重疊
+            if res["status"] in ("success", "exists") and res.get("path"):
+                ready.append(Path(res["path"]))
+                if len(ready) >= ANALYZE_CHUNK: flush_ready()
+
+        try:
+            # 下載器一律回傳 {"total", "success", "fail"} 統計字典
+            downloader = MARKETS_CONFIG[market_id]["downloader"]
+            stats = asyncio.run(downloader.main_async(on_result=submit_ready))
+            logger.info(f"📊 [下載報告] 總計: {stats['total']} | 成功: {stats['success']} | 失敗: {stats['fail']}")
+
+        except Exception:
+            logger.exception(f"❌ {market_name} 數據下載過程發生嚴重異常:")
+
+        # 收集先行分析的結果；失敗者留待 Step 2 重新讀取
+        flush_ready()
+        for fut in futures:
+            try:
+                rows.update(fut.result())
+            except Exception:
+                pass
 
     # --- Step 2: 數據分析 & 繪圖 ---
-    print(f"\n【Step 2: 矩陣分析】正在計算 {market_name} 動能分布並生成圖表...")
+    logger.info(f"【Step 2: 矩陣分析】正在計算 {market_name} 動能分布並生成圖表...")
     try:
-        # 呼叫分析核心
-        img_paths, report_df, text_reports = analyzer.run_global_analysis(market_id=market_id)
+        # 圖表僅供本次郵件使用：寫入暫存目錄，寄送完畢即整個刪除
+        with tempfile.TemporaryDirectory(prefix="charts_") as tmp:
+            # 呼叫分析核心 (已先行分析的標的直接沿用結果)
+            img_paths, report_df, text_reports = analyzer.run_global_analysis(market_id=market_id, rows=rows, image_dir=tmp)
         
-        if report_df is None or report_df.empty:
-            print(f"⚠️ {market_name} 分析結果為空 (可能是 CSV 資料不足)，跳過寄信步驟。")
-            return
+            if report_df is None or report_df.empty:
+                logger.warning(f"⚠️ {market_name} 分析結果為空 (可能是 CSV 資料不足)，跳過寄信步驟。")
+                return
         
-        print(f"✅ 分析完成！成功處理 {len(report_df)} 檔有效數據。")
+            logger.info(f"✅ 分析完成！成功處理 {len(report_df)} 檔有效數據。")
 
-        # --- Step 3: 報表發送 ---
-        print(f"\n【Step 3: 報表發送】正在透過 Resend 傳送郵件...")
+            # --- Step 3: 報表發送 ---
+            logger.info(f"【Step 3: 報表發送】正在透過 Resend 傳送郵件...")
         
-        # 將下載統計 (stats) 與分析結果一併送出
-        success_sent = agent.send_stock_report(
-            market_name=market_name,
-            img_data=img_paths,
-            report_df=report_df,
-            text_reports=text_reports,
-            stats=stats
-        )
+            # 將下載統計 (stats) 與分析結果一併送出
+            success_sent = agent.send_stock_report(
+                market_name=market_name,
+                img_data=img_paths,
+                report_df=report_df,
+                text_reports=text_reports,
+                stats=stats
+            )
         
-        if success_sent:
-            print(f"✅ {market_name} 監控報告已成功寄達！")
-        else:
-            print(f"❌ {market_name} 報告寄送失敗 (請檢查 API Key 或日誌)。")
+            if success_sent:
+                logger.info(f"✅ {market_name} 監控報告已成功寄達！")
+            else:
+                logger.error(f"❌ {market_name} 報告寄送失敗 (請檢查 API Key 或日誌)。")
 
-    except Exception as e:
-        print(f"❌ {market_name} 分析或寄信過程出錯:\n{traceback.format_exc()}")
+    except Exception:
+        logger.exception(f"❌ {market_name} 分析或寄信過程出錯:")
 
 def main():
-    parser = argparse.ArgumentParser(description="Global Stock Monitor Orchestrator")
-    # 將預設值改為 tw-share，並簡化選項
-    parser.add_argument('--market', type=str, default='tw-share', 
-                        choices=['tw-share'], help="僅支援台灣股市")
-    args = parser.parse_args()
+    # 崩潰 (segfault 等) 時輸出所有執行緒的堆疊；並限制記憶體使其快速失敗
+    faulthandler.enable()
+    set_memory_limit()
+    # Log 由背景執行緒寫出，結束前停止 listener 以確保佇列內的訊息全部輸出
+    listener = setup_logging()
+    try:
+        parser = argparse.ArgumentParser(description="Global Stock Monitor Orchestrator")
+        # 市場選項由 MARKETS_CONFIG 產生，argparse 即負責驗證市場 ID
+        parser.add_argument('--market', type=str, default='tw-share', 
+                            choices=list(MARKETS_CONFIG), help="目前僅支援台灣股市")
+        args = parser.parse_args()
 
-    start_time = time.time()
+        start_time = time.time()
     
-    # 獲取台北時間 (UTC+8) 供 Log 記錄
-    now_utc8 = datetime.utcnow() + timedelta(hours=8)
-    now_str = now_utc8.strftime("%Y-%m-%d %H:%M:%S")
+        # 獲取台北時間 (UTC+8) 供 Log 記錄
+        now_str = datetime.now(notifier.TZ).strftime("%Y-%m-%d %H:%M:%S")
     
-    print("\n" + "🚀 " + "="*55)
-    print(f"🚀 股市監控系統啟動 (台灣限定版)")
-    print(f"🚀 啟動時間: {now_str} (UTC+8)")
-    print("🚀 " + "="*55 + "\n")
-
-    # 鎖定市場配置：只保留台灣
-    markets_config = {
-        "tw-share": {"name": "台灣股市", "emoji": "🇹🇼"}
-    }
-
-    # 直接執行台灣股市流程
-    target_market = "tw-share"
-    m_info = markets_config[target_market]
+        logger.info("🚀 " + "="*55)
+        logger.info(f"🚀 股市監控系統啟動 (台灣限定版)")
+        logger.info(f"🚀 啟動時間: {now_str} (UTC+8)")
+        logger.info("🚀 " + "="*55)
+
+        target_market = args.market
+        m_info = MARKETS_CONFIG[target_market]
     
-    run_market_pipeline(target_market, m_info["name"], m_info["emoji"])
+        # 通知器只建立一次，HTTP 連線於各次發送間共用
+        agent = notifier.StockNotifier()
+        run_market_pipeline(target_market, m_info["name"], m_info["emoji"], agent=agent)
 
-    end_time = time.time()
-    total_duration = (end_time - start_time) / 60
-    print("\n" + "="*60)
-    print(f"🎉 任務執行完畢！總耗時: {total_duration:.2f} 分鐘")
-    print("="*60 + "\n")
+        end_time = time.time()
+        total_duration = (end_time - start_time) / 60
+        logger.info("="*60)
+        logger.info(f"🎉 任務執行完畢！總耗時: {total_duration:.2f} 分鐘")
+        logger.info("="*60)
+    finally:
+        listener.stop()
 
 if __name__ == "__main__":
     main()
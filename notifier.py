@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 import os
+import base64
 import requests
 import resend
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# 報表與 Log 時間戳一律使用台北時區 (main.py 亦引用此常數)
+TZ = ZoneInfo("Asia/Taipei")
 
 class StockNotifier:
     def __init__(self):
@@ -15,10 +20,12 @@ class StockNotifier:
         if self.resend_api_key:
             resend.api_key = self.resend_api_key
 
+        # 共用 HTTP 連線 (keep-alive)，同一實例的多次 Telegram 呼叫免重複 TLS 握手
+        self.session = requests.Session()
+
     def get_now_time_str(self):
         """獲取 UTC+8 台北時間"""
-        now_utc8 = datetime.utcnow() + timedelta(hours=8)
-        return now_utc8.strftime("%Y-%m-%d %H:%M:%S")
+        return datetime.now(TZ).strftime("%Y-%m-%d %H:%M:%S")
 
     def send_telegram(self, message):
         """發送 Telegram 即時簡報"""
@@ -36,7 +43,7 @@ class StockNotifier:
             "parse_mode": "HTML"
         }
         try:
-            requests.post(url, json=payload, timeout=10)
+            self.session.post(url, json=payload, timeout=10)
             return True
         except Exception as e:
             print(f"⚠️ Telegram 發送失敗: {e}")
@@ -154,13 +161,14 @@ class StockNotifier:
         """
 
         # --- 5. 處理附件 (Inline Embedding) ---
+        # 圖表以路徑傳入，寄送前才逐一開檔並立即關閉；內容以 Base64 字串附加 (避免 list(bytes) 逐位元組展開成整數)
         attachments = []
         for img in img_data:
             try:
                 if os.path.exists(img['path']):
                     with open(img['path'], "rb") as f:
                         attachments.append({
-                            "content": list(f.read()),
+                            "content": base64.b64encode(f.read()).decode("ascii"),
                             "filename": f"{img['id']}.png",
                             "content_id": img['id'],
                             "disposition": "inline"
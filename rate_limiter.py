@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+
+class TokenBucket:
+    """
+    執行緒安全的權杖桶限速器：多個下載執行緒共用同一個桶，
+    整體平均速率為 rate 次/秒，允許 burst 次的瞬間突發
+    各下載器以模組層級的 BUCKET 取代每次請求前的隨機 sleep：只在實際超速時才等待
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """取得一個權杖；桶內不足時預約下一個權杖並在鎖外等待"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
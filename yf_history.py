@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import random
+from datetime import date, datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import yfinance as yf
+from tqdm import tqdm
+
+def resolve_item(item, data_dir):
+    """解析 "代號&名稱" 清單項目，回傳 (yf_tkr, out_path)；格式錯誤回傳 None"""
+    parts = item.split('&', 1)
+    if len(parts) < 2: return None
+    yf_tkr, name = parts
+    # 移除檔名非法字元
+    safe_name = "".join([c for c in name if c.isalnum() or c in (' ', '_', '-')]).strip()
+    return yf_tkr, os.path.join(data_dir, f"{yf_tkr}_{safe_name}.csv")
+
+def load_list_cache(path):
+    """載入今日產生的 Parquet 清單快取，回傳 "代號&名稱" list；快取不存在或非今日產生回傳 None"""
+    try:
+        mtime = os.path.getmtime(path)
+    except FileNotFoundError:
+        return None
+    if mtime < today_start(): return None
+    df_cache = pd.read_parquet(path)
+    return (df_cache['code'] + "&" + df_cache['name']).tolist()
+
+def save_list_cache(items, path):
+    """將 "代號&名稱" 清單存為 Parquet 快取：先寫暫存檔再原子替換，避免中斷時留下半截檔案"""
+    df_cache = pd.Series(items).str.split('&', n=1, expand=True)
+    df_cache.columns = ['code', 'name']
+    tmp_path = path + ".tmp"
+    df_cache.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+def today_start():
+    """本地時間今日 00:00 的時間戳 (今日快取的判斷門檻，每批或每次執行計算一次後傳入 is_fresh)"""
+    return datetime.combine(date.today(), datetime.min.time()).timestamp()
+
+def is_fresh(out_path, cutoff):
+    """今日快取檢查：檔案於 cutoff (今日零時的時間戳) 之後寫入且大小合理 (單次 os.stat 同時取得大小與修改時間)"""
+    try:
+        st = os.stat(out_path)
+    except FileNotFoundError:
+        return False
+    return st.st_size > 1000 and st.st_mtime >= cutoff
+
+def write_csv(df, out_path):
+    """以 PyArrow 的 C++ 寫出器輸出 CSV，省去 pandas 逐列格式化"""
+    pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), out_path)
+
+def save_history(hist, out_path):
+    """將 yfinance K 線存為統一格式的 CSV (欄位小寫、日期為欄位)"""
+    hist = hist.reset_index()
+    hist.columns = [c.lower() for c in hist.columns]
+    if 'date' in hist.columns:
+        # 日期統一為 YYYY-MM-DD (去除時區，避免寫出時被換算成 UTC 而跨日)
+        dates = pd.to_datetime(hist['date'])
+        if dates.dt.tz is not None: dates = dates.dt.tz_localize(None)
+        hist['date'] = dates.dt.strftime('%Y-%m-%d')
+    write_csv(hist, out_path)
+
+def download_batch(batch, resolve, fallback, timeout=15):
+    """
+    批次下載：以單次 yf.download 取回整批標的 (大幅減少往返次數)，
+    批次中未取得資料者再交由 fallback(item, cutoff) 逐檔重試 (今日門檻每批只計算一次)
+    resolve(item) 回傳 (yf_tkr, out_path)，格式錯誤回傳 None；每檔結果為 {"status", "tkr", "path"}
+    價格一律為還原權值 (auto_adjust=True)，與逐檔備援的 Ticker.history 一致
+    """
+    results, pending, retry = [], {}, []
+    cutoff = today_start()
+    for item in batch:
+        resolved = resolve(item)
+        if resolved is None:
+            results.append({"status": "error", "tkr": item})
+        elif is_fresh(resolved[1], cutoff):
+            results.append({"status": "exists", "tkr": resolved[0], "path": resolved[1]})
+        else:
+            pending[resolved[0]] = (item, resolved[1])
+    if not pending: return results
+
+    try:
+        data = yf.download(list(pending), period="2y", group_by="ticker", actions=True, auto_adjust=True,
+                           threads=True, progress=False, timeout=timeout)
+    except Exception:
+        data = None
+
+    for yf_tkr, (item, out_path) in pending.items():
+        try:
+            hist = data[yf_tkr].dropna(how='all')
+            if hist.empty: raise ValueError(yf_tkr)
+            save_history(hist, out_path)
+            results.append({"status": "success", "tkr": yf_tkr, "path": out_path})
+        except Exception:
+            retry.append(item)
+
+    results.extend(fallback(item, cutoff) for item in retry)
+    return results
+
+def iter_batches(items, batch_size, download, pause=(5, 10), desc=None):
+    """
+    逐批呼叫 download(batch) 並逐檔產出結果，每批完成即交回呼叫端，
+    讓後續處理 (如分析) 與下一批下載重疊進行；批次間休息 uniform(*pause) 秒防止被封鎖 (整批皆為今日快取則免)
+    """
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    pbar = tqdm(total=len(items), desc=desc)
+    for n, batch in enumerate(batches):
+        results = download(batch)
+        yield from results
+        pbar.update(len(batch))
+        if n < len(batches) - 1 and any(r["status"] != "exists" for r in results):
+            time.sleep(random.uniform(*pause))
+    pbar.close()